@@ -16,6 +16,13 @@ export async function runMigrations() {
     )
   `);
 
+  // Binary face encoding (base64 of 128 little-endian float32s), read in
+  // preference to the JSON face_encoding text when present
+  const userColumns = await sqlite.execute(`PRAGMA table_info(users_v1)`);
+  if (!userColumns.rows.some((column: any) => column.name === "face_encoding_b64")) {
+    await sqlite.execute(`ALTER TABLE users_v1 ADD COLUMN face_encoding_b64 TEXT NULL`);
+  }
+
   // Attendance records table
   await sqlite.execute(`
     CREATE TABLE IF NOT EXISTS attendance_v1 (
@@ -2,17 +2,18 @@ import { sqlite } from "https://esm.town/v/stevekrouse/sqlite";
 import type { User, AttendanceRecord, AttendanceStats } from "../../shared/types.ts";
 
 // User management queries
-export async function createUser(name: string, email: string, faceEncoding: string): Promise<number> {
+export async function createUser(name: string, email: string, faceEncoding: string, faceEncodingB64: string | null = null): Promise<number> {
   const result = await sqlite.execute(
-    `INSERT INTO users_v1 (name, email, face_encoding) VALUES (?, ?, ?)`,
-    [name, email, faceEncoding]
+    `INSERT INTO users_v1 (name, email, face_encoding, face_encoding_b64) VALUES (?, ?, ?, ?)`,
+    [name, email, faceEncoding, faceEncodingB64]
   );
   return result.lastInsertRowId as number;
 }
 
 export async function getUserById(id: number): Promise<User | null> {
+  // Face encodings are deliberately not selected; they must never reach clients
   const result = await sqlite.execute(
-    `SELECT * FROM users_v1 WHERE id = ? AND is_active = 1`,
+    `SELECT id, name, email, created_at, is_active FROM users_v1 WHERE id = ? AND is_active = 1`,
     [id]
   );
   return result.rows.length > 0 ? result.rows[0] as User : null;
@@ -33,11 +34,16 @@ export async function getAllUsers(): Promise<User[]> {
   return result.rows as User[];
 }
 
-export async function getAllUserEncodings(): Promise<Array<{id: number, name: string, face_encoding: string}>> {
+// Rows with face_encoding_b64 are decoded directly by the Python service;
+// face_encoding (JSON text) is only sent for rows that predate that column
+export async function getAllUserEncodings(): Promise<Array<{id: number, name: string, face_encoding: string | null, face_encoding_b64: string | null}>> {
   const result = await sqlite.execute(
-    `SELECT id, name, face_encoding FROM users_v1 WHERE is_active = 1`
+    `SELECT id, name,
+       CASE WHEN face_encoding_b64 IS NULL THEN face_encoding END AS face_encoding,
+       face_encoding_b64
+     FROM users_v1 WHERE is_active = 1`
   );
-  return result.rows as Array<{id: number, name: string, face_encoding: string}>;
+  return result.rows as Array<{id: number, name: string, face_encoding: string | null, face_encoding_b64: string | null}>;
 }
 
 // Face samples management
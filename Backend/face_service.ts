@@ -0,0 +1,133 @@
+// Client for the long-lived Python face recognition worker.
+// The worker is spawned once with --serve and keeps the dlib models loaded;
+// requests are written to its stdin as newline-delimited JSON and matched
+// to responses by id.
+
+const SERVICE_SCRIPT = "/python/face_recognition_service.py";
+
+type PendingRequest = {
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+};
+
+let worker: Deno.ChildProcess | null = null;
+let writer: WritableStreamDefaultWriter<Uint8Array> | null = null;
+let nextRequestId = 1;
+const pending = new Map<number, PendingRequest>();
+const encoder = new TextEncoder();
+
+function failPending(error: Error) {
+  for (const request of pending.values()) {
+    request.reject(error);
+  }
+  pending.clear();
+}
+
+async function readResponses(child: Deno.ChildProcess) {
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  for await (const chunk of child.stdout) {
+    buffer += decoder.decode(chunk, { stream: true });
+
+    let newline = buffer.indexOf("\n");
+    while (newline !== -1) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      newline = buffer.indexOf("\n");
+
+      if (!line) continue;
+
+      try {
+        const response = JSON.parse(line);
+        const request = pending.get(response.id);
+        if (request) {
+          pending.delete(response.id);
+          request.resolve(response.result);
+        }
+      } catch (error) {
+        console.error("Invalid response from face recognition worker:", line);
+      }
+    }
+  }
+}
+
+function startWorker() {
+  const child = new Deno.Command("python3", {
+    args: [SERVICE_SCRIPT, "--serve"],
+    stdin: "piped",
+    stdout: "piped",
+    stderr: "inherit"
+  }).spawn();
+
+  worker = child;
+  writer = child.stdin.getWriter();
+
+  readResponses(child).catch((error) => {
+    console.error("Error reading from face recognition worker:", error);
+  });
+
+  child.status.then((status) => {
+    console.error(`Face recognition worker exited with code ${status.code}`);
+    if (worker === child) {
+      worker = null;
+      writer = null;
+    }
+    failPending(new Error("Face recognition worker exited"));
+  });
+}
+
+// Send a command to the Python worker, starting it on first use
+export async function callFaceService(command: string, args: string[]): Promise<any> {
+  if (!worker || !writer) {
+    startWorker();
+  }
+
+  const id = nextRequestId++;
+  const response = new Promise((resolve, reject) => {
+    pending.set(id, { resolve, reject });
+  });
+
+  try {
+    await writer!.write(encoder.encode(JSON.stringify({ id, command, args }) + "\n"));
+  } catch (error) {
+    pending.delete(id);
+    throw error;
+  }
+
+  return response;
+}
+
+// Encode requests arriving within this window are sent as one encode_batch call
+const ENCODE_BATCH_WINDOW_MS = 30;
+
+type QueuedEncode = PendingRequest & { imageData: string };
+
+let encodeQueue: QueuedEncode[] = [];
+let encodeTimer: number | null = null;
+
+async function flushEncodeQueue() {
+  const batch = encodeQueue;
+  encodeQueue = [];
+  encodeTimer = null;
+
+  try {
+    const response = await callFaceService("encode_batch", batch.map((item) => item.imageData));
+    if (!Array.isArray(response.results)) {
+      throw new Error(response.message || "Invalid encode_batch response");
+    }
+    batch.forEach((item, index) => item.resolve(response.results[index]));
+  } catch (error) {
+    batch.forEach((item) => item.reject(error));
+  }
+}
+
+// Extract a face encoding, coalescing concurrent calls into a single batch
+export function encodeFace(imageData: string): Promise<any> {
+  return new Promise((resolve, reject) => {
+    encodeQueue.push({ imageData, resolve, reject });
+    if (encodeTimer === null) {
+      encodeTimer = setTimeout(flushEncodeQueue, ENCODE_BATCH_WINDOW_MS);
+    }
+  });
+}
@@ -1,6 +1,7 @@
 import { Hono } from "https://esm.sh/hono@3.11.7";
 import type { AttendanceRecord, FaceRecognitionResult, CameraCapture } from "../../shared/types.ts";
 import * as db from "../database/queries.ts";
+import { callFaceService } from "../face_service.ts";
 
 const attendance = new Hono();
 
@@ -27,29 +28,19 @@ attendance.post("/checkin", async (c) => {
     }
 
     // Call Python service for face recognition
-    const pythonProcess = new Deno.Command("python3", {
-      args: [
-        "/python/face_recognition_service.py", 
-        "recognize", 
+    let recognitionResult: FaceRecognitionResult;
+    try {
+      recognitionResult = await callFaceService("recognize", [
         image_data, 
         JSON.stringify(knownFaces)
-      ],
-      stdout: "piped",
-      stderr: "piped"
-    });
-
-    const { code, stdout, stderr } = await pythonProcess.output();
-    
-    if (code !== 0) {
-      const errorMsg = new TextDecoder().decode(stderr);
-      console.error("Python service error:", errorMsg);
+      ]) as FaceRecognitionResult;
+    } catch (error) {
+      console.error("Python service error:", error);
       return c.json({ 
         success: false, 
         message: "Face recognition service error" 
       }, 500);
     }
-
-    const recognitionResult = JSON.parse(new TextDecoder().decode(stdout)) as FaceRecognitionResult;
     
     if (!recognitionResult.success) {
       return c.json(recognitionResult);
@@ -103,29 +94,19 @@ attendance.post("/checkout", async (c) => {
     }
 
     // Call Python service for face recognition
-    const pythonProcess = new Deno.Command("python3", {
-      args: [
-        "/python/face_recognition_service.py", 
-        "recognize", 
+    let recognitionResult: FaceRecognitionResult;
+    try {
+      recognitionResult = await callFaceService("recognize", [
         image_data, 
         JSON.stringify(knownFaces)
-      ],
-      stdout: "piped",
-      stderr: "piped"
-    });
-
-    const { code, stdout, stderr } = await pythonProcess.output();
-    
-    if (code !== 0) {
-      const errorMsg = new TextDecoder().decode(stderr);
-      console.error("Python service error:", errorMsg);
+      ]) as FaceRecognitionResult;
+    } catch (error) {
+      console.error("Python service error:", error);
       return c.json({ 
         success: false, 
         message: "Face recognition service error" 
       }, 500);
     }
-
-    const recognitionResult = JSON.parse(new TextDecoder().decode(stdout)) as FaceRecognitionResult;
     
     if (!recognitionResult.success) {
       return c.json(recognitionResult);
@@ -1,6 +1,7 @@
 import { Hono } from "https://esm.sh/hono@3.11.7";
 import type { User, RegistrationData } from "../../shared/types.ts";
 import * as db from "../database/queries.ts";
+import { callFaceService, encodeFace } from "../face_service.ts";
 
 const users = new Hono();
 
@@ -28,8 +29,8 @@ users.get("/:id", async (c) => {
       return c.json({ success: false, message: "User not found" }, 404);
     }
 
-    // Don't return face encoding in the response for security
-    const { face_encoding, ...userWithoutEncoding } = user;
+    // Don't return face encodings in the response for security
+    const { face_encoding, face_encoding_b64, ...userWithoutEncoding } = user;
     return c.json({ success: true, user: userWithoutEncoding });
   } catch (error) {
     console.error("Error fetching user:", error);
@@ -61,44 +62,28 @@ users.post("/register", async (c) => {
     }
 
     // Process face images using Python service
+    // Images are submitted together so the worker can batch face detection
+    let results;
+    try {
+      results = await Promise.all(face_images.map((imageData) => encodeFace(imageData)));
+    } catch (error) {
+      console.error("Python service error:", error);
+      return c.json({ 
+        success: false, 
+        message: "Failed to process face image" 
+      }, 500);
+    }
+
     const faceEncodings = [];
-    for (const imageData of face_images) {
-      try {
-        // Call Python service to extract face encoding
-        const pythonProcess = new Deno.Command("python3", {
-          args: ["/python/face_recognition_service.py", "encode", imageData],
-          stdout: "piped",
-          stderr: "piped"
-        });
-
-        const { code, stdout, stderr } = await pythonProcess.output();
-        
-        if (code !== 0) {
-          const errorMsg = new TextDecoder().decode(stderr);
-          console.error("Python service error:", errorMsg);
-          return c.json({ 
-            success: false, 
-            message: "Failed to process face image" 
-          }, 500);
-        }
-
-        const result = JSON.parse(new TextDecoder().decode(stdout));
-        
-        if (!result.success) {
-          return c.json({ 
-            success: false, 
-            message: result.message || "Failed to extract face encoding" 
-          }, 400);
-        }
-
-        faceEncodings.push(result.encoding);
-      } catch (error) {
-        console.error("Error processing face image:", error);
+    for (const result of results) {
+      if (!result.success) {
         return c.json({ 
           success: false, 
-          message: "Error processing face image" 
-        }, 500);
+          message: result.message || "Failed to extract face encoding" 
+        }, 400);
       }
+
+      faceEncodings.push(result.encoding);
     }
 
     if (faceEncodings.length === 0) {
@@ -112,8 +97,8 @@ users.post("/register", async (c) => {
     // In a production system, you might want to average multiple encodings
     const primaryEncoding = JSON.stringify(faceEncodings[0]);
 
-    // Create user in database
-    const userId = await db.createUser(name, email, primaryEncoding);
+    // Create user in database, with the compact binary encoding used for matching
+    const userId = await db.createUser(name, email, primaryEncoding, results[0].encoding_b64);
 
     // Store additional face samples if provided
     for (let i = 0; i < face_images.length; i++) {
@@ -148,24 +133,16 @@ users.post("/validate-face", async (c) => {
     }
 
     // Call Python service to validate face quality
-    const pythonProcess = new Deno.Command("python3", {
-      args: ["/python/face_recognition_service.py", "validate", image_data],
-      stdout: "piped",
-      stderr: "piped"
-    });
-
-    const { code, stdout, stderr } = await pythonProcess.output();
-    
-    if (code !== 0) {
-      const errorMsg = new TextDecoder().decode(stderr);
-      console.error("Python service error:", errorMsg);
+    let result;
+    try {
+      result = await callFaceService("validate", [image_data]);
+    } catch (error) {
+      console.error("Python service error:", error);
       return c.json({ 
         success: false, 
         message: "Failed to validate face image" 
       }, 500);
     }
-
-    const result = JSON.parse(new TextDecoder().decode(stdout));
     return c.json(result);
 
   } catch (error) {
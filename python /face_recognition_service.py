@@ -4,91 +4,614 @@ Face Recognition Service for Attendance System
 Handles face detection, encoding, and recognition operations
 """
 
-import cv2
-import face_recognition
 import numpy as np
-import base64
 import json
 import sys
+import hashlib
+import importlib
+import queue
+import threading
 from typing import List, Dict, Optional, Tuple
 import pickle
 import os
 from datetime import datetime
 
+# Parsed known-face galleries are cached here; override with FACE_CACHE_DIR
+DEFAULT_CACHE_DIR = os.environ.get(
+    "FACE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".face_cache")
+)
+
+def _is_cache_archive(filename: str) -> bool:
+    """Whether filename looks like a gallery cache archive: <16 hex digits>.npz"""
+    digest, _, extension = filename.partition(".")
+    return (extension == "npz" and len(digest) == 16
+            and all(char in "0123456789abcdef" for char in digest))
+
+class _LazyModule:
+    """Module proxy that defers the real import until first attribute access"""
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Heavy imports (dlib loads its models when face_recognition is imported) are
+# deferred so CLI calls only pay for what their command actually uses
+cv2 = _LazyModule("cv2")
+dlib = _LazyModule("dlib")
+face_recognition = _LazyModule("face_recognition")
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+try:
+    import pybase64 as _b64  # SIMD-accelerated, same API as base64
+except ImportError:
+    import base64 as _b64
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch either
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+def write_json(result: Dict) -> None:
+    """Write a result to stdout as one line of JSON"""
+    if orjson is not None:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n")
+        sys.stdout.buffer.flush()
+    else:
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale vectors (along the last axis) to unit L2 norm"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).eps)
+
+def _nearest_128(matrix, probe):
+    """Index and Euclidean distance of the row closest to probe, for 128-D encodings
+    
+    The fixed 16-wide chunks let LLVM vectorize the distance loop; a row is
+    abandoned as soon as its partial sum exceeds the best distance so far.
+    """
+    if matrix.shape[0] == 0:
+        return -1, np.inf
+
+    # Seed from row 0 rather than an infinite sentinel, so every comparison is
+    # between finite values
+    best = 0.0
+    for k in range(128):
+        diff = matrix[0, k] - probe[k]
+        best += diff * diff
+    best_index = 0
+    for i in range(1, matrix.shape[0]):
+        total = 0.0
+        for chunk in range(0, 128, 16):
+            for k in range(chunk, chunk + 16):
+                diff = matrix[i, k] - probe[k]
+                total += diff * diff
+            if total > best:
+                break
+        if total < best:
+            best = total
+            best_index = i
+    return best_index, np.sqrt(best)
+
+_nearest_128_jit = None
+_numba_unavailable = False
+
+def nearest_128_kernel():
+    """Numba-compiled _nearest_128, importing numba on first use; None if it is not installed"""
+    global _nearest_128_jit, _numba_unavailable
+    if _nearest_128_jit is None and not _numba_unavailable:
+        try:
+            import numba
+        except ImportError:
+            _numba_unavailable = True
+            return None
+        # Fast-math without 'nnan'/'ninf': the kernel's comparisons stay well defined
+        _nearest_128_jit = numba.njit(
+            cache=True, fastmath={'contract', 'reassoc', 'arcp', 'nsz'}, boundscheck=False
+        )(_nearest_128)
+    return _nearest_128_jit
+
+def _quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Symmetrically quantize to int8, returning the values and their scale"""
+    max_abs = float(np.abs(vectors).max()) if vectors.size else 0.0
+    scale = 127.0 / max_abs if max_abs > 0 else 1.0
+    quantized = np.round(vectors * scale).astype(np.int8)
+    return np.ascontiguousarray(quantized), scale
+
+def encode_encoding_b64(encoding: np.ndarray) -> str:
+    """Pack a face encoding as base64 of little-endian float32 bytes (512 bytes for 128-D)"""
+    return _b64.b64encode(encoding.astype('<f4').tobytes()).decode('ascii')
+
+def _decode_encoding_b64(encoding_b64: str) -> np.ndarray:
+    return np.frombuffer(_b64.b64decode(encoding_b64, validate=False), dtype='<f4')
+
+def _parse_face_encoding(person: Dict) -> np.ndarray:
+    """Read a database row's face encoding, preferring the binary column
+    
+    Existing JSON rows can be migrated once with: SELECT id, face_encoding FROM
+    users_v1, then for each row UPDATE users_v1 SET face_encoding_b64 =
+    base64(struct.pack(f'<{len(vec)}f', *vec)) where vec = json.loads(face_encoding).
+    """
+    if person.get('face_encoding_b64'):
+        return _decode_encoding_b64(person['face_encoding_b64'])
+    return np.asarray(_json_loads(person['face_encoding']), dtype=np.float32)
+
 class FaceRecognitionService:
     def __init__(self):
         self.known_face_encodings = []
         self.known_face_names = []
         self.known_face_ids = []
+        self.known_face_matrix = np.empty((0, 128), dtype=np.float32)
+        # Compact gallery copy scanned by simsimd: np.int8 (quantized) or np.float16
+        self.scan_dtype = np.int8
+        self.known_face_matrix_q = np.empty((0, 128), dtype=np.int8)
+        self._gallery_scale = 1.0
+        self.known_face_matrix_f16 = np.empty((0, 128), dtype=np.float16)
+        self._use_simsimd = False  # Set per gallery once the kernel is verified
+        # The compact scan only beats BLAS's float32 matrix-vector product on
+        # large galleries (it is ~3-4x slower at a few hundred faces)
+        self.simsimd_threshold = 5000
+        # Galleries larger than ann_threshold get an HNSW index (if hnswlib is
+        # installed); below it the flat scan beats HNSW's per-query overhead.
+        # Building costs roughly as much as a few thousand flat scans, so it is
+        # only done by the long-lived --serve worker (use_ann_index) once the
+        # current gallery has answered ann_min_queries probes
+        self.ann_threshold = 2000
+        self.ann_min_queries = 5000
+        self.use_ann_index = False
+        self.use_jit_kernel = False  # Numba nearest-face kernel, enabled by --serve
+        self._gallery_queries = 0
+        self._index = None
         self.tolerance = 0.6  # Lower is more strict
+        self.detect_scale_target = 640  # Max long edge (px) for face detection
+        self._detection_model = None  # Resolved on first use, see detection_model
+        self._known_faces_digest = None
+        self.cache_dir = DEFAULT_CACHE_DIR
+        self.cache_max_entries = 8  # Galleries kept on disk; older ones are pruned
+        self.persist_cache = True  # Disabled in --serve, where the gallery stays in memory
+        self._tj = self._init_turbojpeg()
+        self.validate_scale_target = 480  # Max long edge (px) for quality validation
+        self.validate_confirm_with_dlib = True  # Re-check with dlib when the cascade finds nothing
+        self._cv_face = None
+        self._cv_face_loaded = False
+        self.enroll_num_jitters = 1  # Raise to average jittered copies when registering faces
         
+    @property
+    def use_gpu(self) -> bool:
+        """Whether dlib was built with CUDA"""
+        return bool(getattr(dlib, 'DLIB_USE_CUDA', False))
+    
+    @property
+    def detection_model(self) -> str:
+        """dlib detector: CNN when dlib was built with CUDA, HOG otherwise"""
+        if self._detection_model is None:
+            self._detection_model = "cnn" if self.use_gpu else "hog"
+        return self._detection_model
+    
+    @detection_model.setter
+    def detection_model(self, model: str) -> None:
+        self._detection_model = model
+    
+    def preload_models(self) -> None:
+        """Import dlib/face_recognition and load the detectors ahead of the first request"""
+        importlib.import_module("face_recognition")
+        self.detection_model
+        self._face_cascade()
+        self._face_models()
+    
+    def _face_models(self):
+        """dlib's 5-point landmark predictor and face encoder
+        
+        These are the instances face_recognition builds on import, so the model
+        files are loaded once. Calling them directly skips face_recognition's
+        per-call wrapping; on a CUDA build of dlib the encoder runs on the GPU.
+        Only the pipeline's encoder thread uses them, so sharing is safe.
+        """
+        return face_recognition.api.pose_predictor_5_point, face_recognition.api.face_encoder
+    
+    def _face_cascade(self):
+        """Load OpenCV's frontal face Haar cascade on first use, or None if it is not bundled"""
+        if not self._cv_face_loaded:
+            self._cv_face_loaded = True
+            try:
+                cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+                self._cv_face = None if cascade.empty() else cascade
+            except AttributeError:
+                self._cv_face = None
+        return self._cv_face
+    
+    def _init_turbojpeg(self):
+        """Create a libjpeg-turbo decoder if PyTurboJPEG and the shared library are available"""
+        if TurboJPEG is None:
+            return None
+        try:
+            return TurboJPEG()
+        except Exception as e:
+            print(f"TurboJPEG unavailable, using OpenCV decoder: {e}", file=sys.stderr)
+            return None
+    
     def encode_image_to_base64(self, image_path: str) -> str:
         """Convert image file to base64 string"""
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return _b64.b64encode(image_file.read()).decode('utf-8')
     
-    def decode_base64_to_image(self, base64_string: str) -> np.ndarray:
-        """Convert base64 string to OpenCV image"""
-        # Remove data URL prefix if present
+    def decode_base64_to_rgb(self, base64_string: str) -> np.ndarray:
+        """Convert base64 string to an RGB image"""
+        # Remove data URL prefix if present (one slice, no intermediate list)
         if base64_string.startswith('data:image'):
-            base64_string = base64_string.split(',')[1]
+            base64_string = base64_string[base64_string.index(',') + 1:]
+        
+        image_data = _b64.b64decode(base64_string, validate=False)
+        
+        # libjpeg-turbo decodes JPEG straight to RGB, skipping the BGR intermediate
+        if self._tj is not None:
+            try:
+                return self._tj.decode(image_data, pixel_format=TJPF_RGB)
+            except Exception:
+                pass
         
-        image_data = base64.b64decode(base64_string)
+        # np.frombuffer wraps the decoded bytes without copying
         nparr = np.frombuffer(image_data, np.uint8)
         image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        return image
+        # Convert BGR to RGB in place (OpenCV uses BGR, face_recognition uses RGB)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    
+    def decode_images(self, base64_images: List[str]) -> List[Optional[np.ndarray]]:
+        """Decode base64 images to RGB, using None for any that fail to decode"""
+        images = []
+        for base64_image in base64_images:
+            try:
+                images.append(self.decode_base64_to_rgb(base64_image))
+            except Exception as e:
+                print(f"Error processing image: {e}", file=sys.stderr)
+                images.append(None)
+        return images
     
-    def extract_face_encoding(self, image: np.ndarray) -> Optional[List[float]]:
-        """Extract face encoding from image"""
-        # Convert BGR to RGB (OpenCV uses BGR, face_recognition uses RGB)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    def _prep(self, image: np.ndarray, target: Optional[int] = None) -> Tuple[np.ndarray, float]:
+        """Downscale image so its long edge is at most target (default detect_scale_target)"""
+        target = target or self.detect_scale_target
+        height, width = image.shape[:2]
+        long_edge = max(height, width)
+        if long_edge <= target:
+            return image, 1.0
         
-        # Find face locations
-        face_locations = face_recognition.face_locations(rgb_image)
+        scale = target / long_edge
+        small_image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return small_image, scale
+    
+    def _locate_faces(self, rgb_image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """Run the configured dlib face detector"""
+        if self.detection_model == "cnn":
+            return face_recognition.face_locations(rgb_image, number_of_times_to_upsample=0, model="cnn")
+        return face_recognition.face_locations(rgb_image)
+    
+    def _detect_faces_for_validation(self, rgb_image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """Cheap face detection for quality checks using the Haar cascade"""
+        cascade = self._face_cascade()
+        if cascade is None:
+            return self._detect_face_locations(rgb_image)
         
-        if not face_locations:
-            return None
+        small_image, scale = self._prep(rgb_image, self.validate_scale_target)
+        gray_image = cv2.cvtColor(small_image, cv2.COLOR_RGB2GRAY)
+        # Faces under 50px at full resolution are rejected as too small anyway
+        min_side = max(1, int(50 * scale))
+        rects = cascade.detectMultiScale(
+            gray_image, scaleFactor=1.2, minNeighbors=4, minSize=(min_side, min_side)
+        )
         
-        # Get face encodings
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        if len(rects) == 0:
+            if self.validate_confirm_with_dlib:
+                return self._detect_face_locations(rgb_image)
+            return []
         
-        if not face_encodings:
+        return [
+            (int(y / scale), int((x + w) / scale), int((y + h) / scale), int(x / scale))
+            for x, y, w, h in rects
+        ]
+    
+    def _detect_face_locations(self, rgb_image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """Detect faces on a downscaled copy and map locations back to full resolution"""
+        small_image, scale = self._prep(rgb_image)
+        face_locations = self._locate_faces(small_image)
+        if scale == 1.0:
+            return face_locations
+        
+        return [
+            (int(top / scale), int(right / scale), int(bottom / scale), int(left / scale))
+            for top, right, bottom, left in face_locations
+        ]
+    
+    def encode_first_face(self, rgb_image: np.ndarray, face_locations: List[Tuple[int, int, int, int]],
+                          num_jitters: int = 0) -> Optional[np.ndarray]:
+        """Encode the first of the given face locations"""
+        if not face_locations:
             return None
         
+        predictor, encoder = self._face_models()
+        top, right, bottom, left = face_locations[0]
+        shape = predictor(rgb_image, dlib.rectangle(left, top, right, bottom))
+        return np.array(encoder.compute_face_descriptor(rgb_image, shape, num_jitters))
+    
+    def extract_face_encoding(self, rgb_image: np.ndarray, num_jitters: int = 0) -> Optional[np.ndarray]:
+        """Extract face encoding from RGB image"""
+        # Find face locations
+        face_locations = self._detect_face_locations(rgb_image)
+        
         # Return the first face encoding found
-        return face_encodings[0].tolist()
+        return self.encode_first_face(rgb_image, face_locations, num_jitters)
+    
+    def detect_faces_batch(self, rgb_images: List[Optional[np.ndarray]]) -> List[List[Tuple[int, int, int, int]]]:
+        """Detect faces in several RGB images, batching CNN detection across images"""
+        locations: List[List[Tuple[int, int, int, int]]] = [[] for _ in rgb_images]
+        
+        # Group detection-sized images by shape; the CNN batch API needs equal sizes
+        groups: Dict[Tuple[int, ...], List[Tuple[int, np.ndarray, float]]] = {}
+        for index, rgb_image in enumerate(rgb_images):
+            if rgb_image is None:
+                continue
+            small_image, scale = self._prep(rgb_image)
+            groups.setdefault(small_image.shape, []).append((index, small_image, scale))
+        
+        for group in groups.values():
+            if self.detection_model == "cnn":
+                batch_locations = face_recognition.batch_face_locations(
+                    [small_image for _, small_image, _ in group],
+                    number_of_times_to_upsample=0,
+                    batch_size=8
+                )
+            else:
+                batch_locations = [self._locate_faces(small_image) for _, small_image, _ in group]
+            
+            for (index, _, scale), face_locations in zip(group, batch_locations):
+                locations[index] = [
+                    (int(top / scale), int(right / scale), int(bottom / scale), int(left / scale))
+                    for top, right, bottom, left in face_locations
+                ]
+        
+        return locations
     
-    def extract_face_encoding_from_base64(self, base64_image: str) -> Optional[List[float]]:
+    def extract_face_encodings_batch(self, rgb_images: List[Optional[np.ndarray]],
+                                     num_jitters: int = 0) -> List[Optional[np.ndarray]]:
+        """Extract one face encoding per RGB image, batching CNN detection across images"""
+        batch_locations = self.detect_faces_batch(rgb_images)
+        return [
+            self.encode_first_face(rgb_image, face_locations, num_jitters) if rgb_image is not None else None
+            for rgb_image, face_locations in zip(rgb_images, batch_locations)
+        ]
+    
+    def extract_face_encoding_from_base64(self, base64_image: str, num_jitters: int = 0) -> Optional[np.ndarray]:
         """Extract face encoding from base64 image"""
         try:
-            image = self.decode_base64_to_image(base64_image)
-            return self.extract_face_encoding(image)
+            rgb_image = self.decode_base64_to_rgb(base64_image)
+            return self.extract_face_encoding(rgb_image, num_jitters)
         except Exception as e:
             print(f"Error processing image: {e}", file=sys.stderr)
             return None
     
     def load_known_faces(self, face_data: List[Dict]) -> None:
-        """Load known faces from database data"""
+        """Load known faces from database data
+        
+        Rows carrying a binary 'face_encoding_b64' are decoded directly; rows
+        with only the JSON 'face_encoding' text are still accepted.
+        """
+        legacy_rows = sum(1 for person in face_data if not person.get('face_encoding_b64'))
+        if legacy_rows:
+            print(f"Deprecated: {legacy_rows} face encoding(s) stored as JSON text; "
+                  f"re-save them as face_encoding_b64", file=sys.stderr)
+        self._load_faces(face_data, _parse_face_encoding)
+    
+    def load_known_faces_binary(self, face_data: List[Dict]) -> None:
+        """Load known faces whose encodings are base64 float32 bytes ('face_encoding_b64')"""
+        self._load_faces(face_data, lambda person: _decode_encoding_b64(person['face_encoding_b64']))
+    
+    def _load_faces(self, face_data: List[Dict], parse_encoding) -> None:
+        self._known_faces_digest = None
         self.known_face_encodings = []
         self.known_face_names = []
         self.known_face_ids = []
         
         for person in face_data:
             try:
-                # Parse the face encoding from JSON string
-                encoding = json.loads(person['face_encoding'])
-                self.known_face_encodings.append(np.array(encoding))
+                encoding = parse_encoding(person)
+                # A single wrong-length row would otherwise break stacking the whole gallery
+                if encoding.shape != (128,):
+                    raise ValueError(f"expected a 128-value face encoding, got shape {encoding.shape}")
+                self.known_face_encodings.append(encoding)
                 self.known_face_names.append(person['name'])
                 self.known_face_ids.append(person['id'])
             except Exception as e:
                 print(f"Error loading face data for {person.get('name', 'unknown')}: {e}", file=sys.stderr)
+        
+        self._build_face_matrix()
+    
+    def load_known_faces_cached(self, known_faces_json: str, cache_dir: Optional[str] = None) -> None:
+        """Load known faces, reusing a cached encoding matrix keyed by the raw JSON payload"""
+        cache_dir = cache_dir or self.cache_dir
+        json_bytes = known_faces_json.encode('utf-8')
+        digest = hashlib.sha1(json_bytes).hexdigest()[:16]
+        if digest == self._known_faces_digest:
+            return
+        cache_path = os.path.join(cache_dir, f"{digest}.npz")
+        
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as cached:
+                    self.known_face_encodings = list(cached['encodings'])
+                    self.known_face_ids = cached['ids'].tolist()
+                    self.known_face_names = cached['names'].tolist()
+                self._build_face_matrix()
+                self._known_faces_digest = digest
+                # Refresh mtime so pruning evicts least recently used galleries
+                os.utime(cache_path)
+                return
+            except Exception as e:
+                print(f"Ignoring unreadable face cache {cache_path}: {e}", file=sys.stderr)
+        
+        self.load_known_faces(_json_loads(known_faces_json))
+        self._known_faces_digest = digest
+        
+        if not self.persist_cache:
+            return
+        
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as cache_file:
+                np.savez(
+                    cache_file,
+                    encodings=self.known_face_matrix,
+                    ids=np.asarray(self.known_face_ids, dtype=np.int64),
+                    names=np.asarray(self.known_face_names, dtype=str)
+                )
+            os.replace(tmp_path, cache_path)
+            self._prune_cache(cache_dir)
+        except Exception as e:
+            print(f"Error writing face cache {cache_path}: {e}", file=sys.stderr)
+    
+    def _prune_cache(self, cache_dir: str) -> None:
+        """Keep only the cache_max_entries most recently used gallery archives"""
+        # Only touch our own <digest>.npz files; cache_dir may be a shared directory
+        galleries = sorted(
+            (entry for entry in os.scandir(cache_dir) if _is_cache_archive(entry.name)),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True
+        )
+        
+        for entry in galleries[self.cache_max_entries:]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    
+    def _build_face_matrix(self) -> None:
+        """Stack known encodings into one contiguous float32 matrix for vectorized matching"""
+        if self.known_face_encodings:
+            matrix = np.stack(self.known_face_encodings).astype(np.float32, copy=False)
+        else:
+            matrix = np.empty((0, 128), dtype=np.float32)
+        # dlib's ResNet descriptors are L2-normalized; renormalize to guard against drift
+        self.known_face_matrix = np.ascontiguousarray(_normalize_rows(matrix))
+        self._use_simsimd = False
+        if len(self.known_face_matrix) > self.simsimd_threshold:
+            if self.scan_dtype == np.float16:
+                # Unit-norm encodings are well within float16 precision for a 0.6 tolerance
+                self.known_face_matrix_f16 = self.known_face_matrix.astype(np.float16)
+            else:
+                self.known_face_matrix_q, self._gallery_scale = _quantize_int8(self.known_face_matrix)
+            self._use_simsimd = self._check_simsimd_scores()
+        self._index = None
+        self._gallery_queries = 0
+    
+    def _ann_index(self, num_probes: int):
+        """HNSW index for the gallery, built once enough queries have been served to pay for it"""
+        if self._index is not None or not self.use_ann_index or hnswlib is None:
+            return self._index
+        
+        count = len(self.known_face_matrix)
+        self._gallery_queries += num_probes
+        if count <= self.ann_threshold or self._gallery_queries < self.ann_min_queries:
+            return None
+        
+        index = hnswlib.Index(space='l2', dim=self.known_face_matrix.shape[1])
+        index.init_index(max_elements=count, ef_construction=200, M=16)
+        index.add_items(self.known_face_matrix, np.arange(count))
+        index.set_ef(50)
+        self._index = index
+        return index
+    
+    def _simsimd_scores(self, probe: np.ndarray) -> np.ndarray:
+        """Approximate dot products from the compact gallery copy via simsimd
+        
+        int8 is 4x and float16 2x less memory traffic than float32; the scores
+        are only used for ranking.
+        """
+        if self.scan_dtype == np.float16:
+            probe_h = probe.astype(np.float16)[None, :]
+            scores = simsimd.cdist(self.known_face_matrix_f16, probe_h, metric='dot')
+            return np.asarray(scores, dtype=np.float32).ravel()
+        
+        probe_q, probe_scale = _quantize_int8(probe)
+        scores = simsimd.cdist(self.known_face_matrix_q, probe_q[None, :], metric='dot')
+        return np.asarray(scores, dtype=np.float32).ravel() / (self._gallery_scale * probe_scale)
+    
+    def _check_simsimd_scores(self) -> bool:
+        """Whether simsimd's compact 'dot' kernel agrees with float32 on this gallery
+        
+        Older simsimd releases return a cosine distance for int8 'dot', which
+        would rank the farthest face first.
+        """
+        if simsimd is None or not hasattr(simsimd, 'cdist') or not len(self.known_face_matrix):
+            return False
+        
+        probe = self.known_face_matrix[0]
+        try:
+            scores = self._simsimd_scores(probe)
+        except (TypeError, ValueError):
+            return False
+        return bool(np.allclose(scores, self.known_face_matrix @ probe, atol=0.05))
+    
+    def _similarity_scores(self, probe: np.ndarray) -> np.ndarray:
+        """Dot product of a unit-norm probe with every known face"""
+        if self._use_simsimd:
+            try:
+                return self._simsimd_scores(probe)
+            except (TypeError, ValueError):
+                pass
+        
+        return self.known_face_matrix @ probe
+    
+    def _nearest_face(self, probe: np.ndarray) -> int:
+        """Index of the known face closest to a unit-norm probe"""
+        index = self._ann_index(1)
+        if index is not None:
+            labels, _ = index.knn_query(probe, k=1)
+            return int(labels[0][0])
+        
+        # Without a usable simsimd, the --serve worker (use_jit_kernel) prefers the
+        # JIT-compiled kernel for dlib's 128-D encodings; one-shot CLI calls stay
+        # on BLAS rather than pay numba's import and compile time
+        if self.use_jit_kernel and not self._use_simsimd and self.known_face_matrix.shape[1] == 128:
+            kernel = nearest_128_kernel()
+            if kernel is not None:
+                best_match_index, _ = kernel(self.known_face_matrix, probe)
+                return int(best_match_index)
+        
+        return int(self._similarity_scores(probe).argmax())
     
     def recognize_face(self, base64_image: str) -> Dict:
         """Recognize face in the given image"""
+        # Extract face encoding from input image
+        face_encoding = self.extract_face_encoding_from_base64(base64_image)
+        return self.match_face_encoding(face_encoding)
+    
+    def match_face_encoding(self, face_encoding: Optional[np.ndarray]) -> Dict:
+        """Match a face encoding against the loaded known faces"""
         try:
-            # Extract face encoding from input image
-            face_encoding = self.extract_face_encoding_from_base64(base64_image)
-            
             if face_encoding is None:
                 return {
                     "success": False,
@@ -96,39 +619,24 @@ class FaceRecognitionService:
                     "confidence": 0.0
                 }
             
-            if not self.known_face_encodings:
+            if not len(self.known_face_matrix):
                 return {
                     "success": False,
                     "message": "No registered faces in the system",
                     "confidence": 0.0
                 }
             
-            # Compare with known faces
-            face_distances = face_recognition.face_distance(
-                self.known_face_encodings, 
-                np.array(face_encoding)
-            )
+            # Compare with known faces; for unit vectors ||a-b||^2 = 2 - 2a.b,
+            # so the nearest face is the one with the largest dot product
+            probe = np.ascontiguousarray(_normalize_rows(face_encoding.astype(np.float32, copy=False)))
             
             # Find the best match
-            best_match_index = np.argmin(face_distances)
-            best_distance = face_distances[best_match_index]
+            best_match_index = self._nearest_face(probe)
+            # Rescore the winner in float32 so the tolerance check is unaffected by quantization
+            best_score = float(self.known_face_matrix[best_match_index] @ probe)
+            best_distance = float(np.sqrt(max(0.0, 2 - 2 * best_score)))
             
-            # Check if the match is within tolerance
-            if best_distance <= self.tolerance:
-                confidence = (1 - best_distance) * 100  # Convert to percentage
-                return {
-                    "success": True,
-                    "user_id": self.known_face_ids[best_match_index],
-                    "user_name": self.known_face_names[best_match_index],
-                    "confidence": round(confidence, 2),
-                    "message": f"Face recognized: {self.known_face_names[best_match_index]}"
-                }
-            else:
-                return {
-                    "success": False,
-                    "message": "Face not recognized",
-                    "confidence": round((1 - best_distance) * 100, 2)
-                }
+            return self._match_result(best_match_index, best_distance)
                 
         except Exception as e:
             return {
@@ -137,14 +645,82 @@ class FaceRecognitionService:
                 "confidence": 0.0
             }
     
+    def _match_result(self, best_match_index: int, best_distance: float) -> Dict:
+        """Build the recognition result for the closest known face"""
+        # Check if the match is within tolerance
+        if best_distance <= self.tolerance:
+            confidence = (1 - best_distance) * 100  # Convert to percentage
+            return {
+                "success": True,
+                "user_id": self.known_face_ids[best_match_index],
+                "user_name": self.known_face_names[best_match_index],
+                "confidence": round(confidence, 2),
+                "message": f"Face recognized: {self.known_face_names[best_match_index]}"
+            }
+        else:
+            return {
+                "success": False,
+                "message": "Face not recognized",
+                "confidence": round((1 - best_distance) * 100, 2)
+            }
+    
+    def match_face_encodings(self, face_encodings: List[Optional[np.ndarray]]) -> List[Dict]:
+        """Match several face encodings against the known faces with one matrix product"""
+        results: List[Optional[Dict]] = [None] * len(face_encodings)
+        found = [index for index, encoding in enumerate(face_encodings) if encoding is not None]
+        
+        if found and len(self.known_face_matrix):
+            try:
+                probes = _normalize_rows(np.stack([face_encodings[index] for index in found]).astype(np.float32))
+                index = self._ann_index(len(found))
+                if index is not None:
+                    labels, _ = index.knn_query(probes, k=1)
+                    best_indices = labels[:, 0].astype(np.intp)
+                    best_scores = np.einsum('ij,ij->i', self.known_face_matrix[best_indices], probes)
+                else:
+                    # (N, K) dot products in a single GEMM; nearest face per probe is the max of each column
+                    scores = self.known_face_matrix @ probes.T
+                    best_indices = scores.argmax(axis=0)
+                    best_scores = scores[best_indices, np.arange(len(found))]
+                best_distances = np.sqrt(np.maximum(0.0, 2 - 2 * best_scores))
+                
+                for column, index in enumerate(found):
+                    results[index] = self._match_result(int(best_indices[column]), float(best_distances[column]))
+            except Exception as e:
+                for index in found:
+                    results[index] = {
+                        "success": False,
+                        "message": f"Error during face recognition: {str(e)}",
+                        "confidence": 0.0
+                    }
+        
+        # Missing faces and an empty gallery get the same results as single-image matching
+        return [
+            result if result is not None else self.match_face_encoding(encoding)
+            for result, encoding in zip(results, face_encodings)
+        ]
+    
+    def recognize_faces_batch(self, base64_images: List[str]) -> List[Dict]:
+        """Recognize faces in several images, e.g. a burst of frames of one person"""
+        rgb_images = self.decode_images(base64_images)
+        return self.match_face_encodings(self.extract_face_encodings_batch(rgb_images))
+    
     def validate_face_quality(self, base64_image: str) -> Dict:
         """Validate if the image has good quality for face recognition"""
         try:
-            image = self.decode_base64_to_image(base64_image)
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
+            rgb_image = self.decode_base64_to_rgb(base64_image)
+        except Exception as e:
+            return {
+                "valid": False,
+                "message": f"Error validating image: {str(e)}"
+            }
+        return self.validate_face_image(rgb_image)
+    
+    def validate_face_image(self, rgb_image: np.ndarray) -> Dict:
+        """Validate face quality of an already decoded RGB image"""
+        try:
             # Find face locations
-            face_locations = face_recognition.face_locations(rgb_image)
+            face_locations = self._detect_faces_for_validation(rgb_image)
             
             if not face_locations:
                 return {
@@ -170,7 +746,7 @@ class FaceRecognitionService:
                 }
             
             # Check if face is too close to edges
-            img_height, img_width = image.shape[:2]
+            img_height, img_width = rgb_image.shape[:2]
             if (left < 20 or top < 20 or 
                 right > img_width - 20 or bottom > img_height - 20):
                 return {
@@ -189,73 +765,286 @@ class FaceRecognitionService:
                 "message": f"Error validating image: {str(e)}"
             }
 
-def main():
-    """Main function to handle command line interface"""
-    if len(sys.argv) < 2:
-        print("Usage: python face_recognition_service.py <command> [args...]")
-        print("Commands:")
-        print("  encode <base64_image> - Extract face encoding from image")
-        print("  recognize <base64_image> <known_faces_json> - Recognize face")
-        print("  validate <base64_image> - Validate face quality")
-        sys.exit(1)
+COMMAND_USAGE = {
+    "encode": "encode <base64_image>",
+    "recognize": "recognize <base64_image> <known_faces_json>",
+    "validate": "validate <base64_image>",
+    "encode_batch": "encode_batch <base64_image> [<base64_image> ...]",
+    "recognize_batch": "recognize_batch <base64_images_json> <known_faces_json>",
+}
+
+# Commands accepting one or more trailing arguments
+VARIADIC_COMMANDS = {"encode_batch"}
+
+def check_command_args(command: str, args: List[str]) -> None:
+    """Raise ValueError if the command is unknown or has the wrong number of arguments"""
+    if command not in COMMAND_USAGE:
+        raise ValueError(f"Unknown command: {command}")
     
-    service = FaceRecognitionService()
-    command = sys.argv[1]
+    if command in VARIADIC_COMMANDS:
+        if not args:
+            raise ValueError(f"Usage: {COMMAND_USAGE[command]}")
+    elif len(args) != len(COMMAND_USAGE[command].split()) - 1:
+        raise ValueError(f"Usage: {COMMAND_USAGE[command]}")
+
+def encoding_result(encoding: Optional[np.ndarray]) -> Dict:
+    """Build the JSON result for an extracted face encoding"""
+    if encoding is not None:
+        return {
+            "success": True,
+            # orjson serializes the array buffer directly; stdlib json needs a list
+            "encoding": encoding if orjson is not None else encoding.astype(float).tolist(),
+            "encoding_b64": encode_encoding_b64(encoding),
+            "message": "Face encoding extracted successfully"
+        }
+    return {
+        "success": False,
+        "encoding": None,
+        "encoding_b64": None,
+        "message": "No face detected in image"
+    }
+
+def batch_result(results: List[Dict]) -> Dict:
+    """Build the JSON result wrapping per-image results of a batch command"""
+    return {
+        "success": any(result["success"] for result in results),
+        "results": results
+    }
+
+def parse_images_json(base64_images_json: str) -> List[str]:
+    """Parse a JSON array of base64 images"""
+    base64_images = _json_loads(base64_images_json)
+    if not isinstance(base64_images, list) or not base64_images:
+        raise ValueError("Expected a non-empty JSON array of base64 images")
+    return base64_images
+
+def load_known_faces_result(service: FaceRecognitionService, known_faces_json: str) -> Optional[Dict]:
+    """Load known faces, returning an error result if the JSON is invalid"""
+    try:
+        service.load_known_faces_cached(known_faces_json)
+    except json.JSONDecodeError:
+        return {
+            "success": False,
+            "message": "Invalid JSON format for known faces"
+        }
+    return None
+
+def run_command(service: FaceRecognitionService, command: str, args: List[str]) -> Dict:
+    """Run a single service command and return its JSON-serializable result"""
+    check_command_args(command, args)
     
     if command == "encode":
-        if len(sys.argv) != 3:
-            print("Usage: encode <base64_image>")
-            sys.exit(1)
+        return encoding_result(service.extract_face_encoding_from_base64(args[0], service.enroll_num_jitters))
+    
+    if command == "encode_batch":
+        images = service.decode_images(args)
+        encodings = service.extract_face_encodings_batch(images, service.enroll_num_jitters)
+        return batch_result([encoding_result(encoding) for encoding in encodings])
+    
+    if command == "recognize":
+        base64_image, known_faces_json = args
         
-        base64_image = sys.argv[2]
-        encoding = service.extract_face_encoding_from_base64(base64_image)
+        error = load_known_faces_result(service, known_faces_json)
+        if error:
+            return error
+        return service.recognize_face(base64_image)
+    
+    if command == "recognize_batch":
+        base64_images_json, known_faces_json = args
         
-        if encoding:
-            result = {
-                "success": True,
-                "encoding": encoding,
-                "message": "Face encoding extracted successfully"
-            }
-        else:
-            result = {
+        try:
+            base64_images = parse_images_json(base64_images_json)
+        except (json.JSONDecodeError, ValueError):
+            return {
                 "success": False,
-                "encoding": None,
-                "message": "No face detected in image"
+                "message": "Invalid JSON format for images"
             }
         
-        print(json.dumps(result))
+        error = load_known_faces_result(service, known_faces_json)
+        if error:
+            return error
+        return batch_result(service.recognize_faces_batch(base64_images))
+    
+    return service.validate_face_quality(args[0])
+
+class ServePipeline:
+    """Decode -> detect -> encode/match thread pipeline for --serve mode
+    
+    Each stage runs in its own thread and hands jobs on through a bounded
+    queue, so decoding, detection and encoding of consecutive requests
+    overlap. dlib and OpenCV release the GIL inside their C++ code.
+    Responses are written as soon as a job finishes and are matched to
+    requests by id, so they may arrive out of order.
+    """
+    
+    def __init__(self, service: FaceRecognitionService, queue_size: int = 4):
+        self.service = service
+        self.q_decode: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.q_detect: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.q_encode: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._output_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._decoder_worker, daemon=True),
+            threading.Thread(target=self._detector_worker, daemon=True),
+            threading.Thread(target=self._encoder_worker, daemon=True),
+        ]
+    
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+    
+    def submit(self, request_id, command: str, args: List[str]) -> None:
+        """Queue a request, answering immediately if it is malformed"""
+        try:
+            check_command_args(command, args)
+        except ValueError as e:
+            self.respond(request_id, {"success": False, "message": str(e)})
+            return
+        self.q_decode.put({"id": request_id, "command": command, "args": args})
+    
+    def close(self) -> None:
+        """Drain all queued jobs and stop the workers"""
+        self.q_decode.put(None)
+        for thread in self._threads:
+            thread.join()
     
-    elif command == "recognize":
-        if len(sys.argv) != 4:
-            print("Usage: recognize <base64_image> <known_faces_json>")
-            sys.exit(1)
+    def respond(self, request_id, result: Dict) -> None:
+        with self._output_lock:
+            write_json({"id": request_id, "result": result})
+    
+    def _run_stage(self, source: queue.Queue, target: Optional[queue.Queue], handler) -> None:
+        """Apply handler to each job from source and pass it on to target"""
+        while True:
+            job = source.get()
+            if job is None:
+                if target is not None:
+                    target.put(None)
+                return
+            
+            try:
+                handler(job)
+            except Exception as e:
+                job["result"] = {"success": False, "message": f"Error processing request: {str(e)}"}
+            
+            if "result" in job:
+                self.respond(job["id"], job["result"])
+            elif target is not None:
+                target.put(job)
+    
+    def _decoder_worker(self) -> None:
+        self._run_stage(self.q_decode, self.q_detect, self._decode)
+    
+    def _detector_worker(self) -> None:
+        self._run_stage(self.q_detect, self.q_encode, self._detect)
+    
+    def _encoder_worker(self) -> None:
+        self._run_stage(self.q_encode, None, self._encode)
+    
+    def _decode(self, job: Dict) -> None:
+        if job["command"] == "encode_batch":
+            job["images"] = self.service.decode_images(job["args"])
+        elif job["command"] == "recognize_batch":
+            try:
+                base64_images = parse_images_json(job["args"][0])
+            except (json.JSONDecodeError, ValueError):
+                job["result"] = {"success": False, "message": "Invalid JSON format for images"}
+                return
+            job["images"] = self.service.decode_images(base64_images)
+        elif job["command"] == "validate":
+            try:
+                job["images"] = [self.service.decode_base64_to_rgb(job["args"][0])]
+            except Exception as e:
+                job["result"] = {"valid": False, "message": f"Error validating image: {str(e)}"}
+        else:
+            job["images"] = self.service.decode_images(job["args"][:1])
+    
+    def _detect(self, job: Dict) -> None:
+        if job["command"] == "validate":
+            job["result"] = self.service.validate_face_image(job["images"][0])
+        else:
+            job["locations"] = self.service.detect_faces_batch(job["images"])
+    
+    def _encode(self, job: Dict) -> None:
+        # Extra jitters are only worth their cost when registering a face
+        num_jitters = self.service.enroll_num_jitters if job["command"].startswith("encode") else 0
+        encodings = [
+            self.service.encode_first_face(rgb_image, face_locations, num_jitters) if rgb_image is not None else None
+            for rgb_image, face_locations in zip(job["images"], job["locations"])
+        ]
         
-        base64_image = sys.argv[2]
-        known_faces_json = sys.argv[3]
+        if job["command"] == "encode_batch":
+            job["result"] = batch_result([encoding_result(encoding) for encoding in encodings])
+        elif job["command"] == "encode":
+            job["result"] = encoding_result(encodings[0])
+        else:
+            # Matching runs in this single thread, so the gallery can't change mid-match
+            error = load_known_faces_result(self.service, job["args"][1])
+            if error:
+                job["result"] = error
+            elif job["command"] == "recognize_batch":
+                job["result"] = batch_result(self.service.match_face_encodings(encodings))
+            else:
+                job["result"] = self.service.match_face_encoding(encodings[0])
+
+def serve(service: FaceRecognitionService) -> None:
+    """Process newline-delimited JSON requests from stdin, keeping models loaded"""
+    service.preload_models()
+    # The worker keeps its gallery in memory, so don't write a copy per registration
+    service.persist_cache = False
+    service.use_ann_index = True
+    service.use_jit_kernel = True
+    pipeline = ServePipeline(service)
+    pipeline.start()
+    
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
         
+        request_id = None
         try:
-            known_faces = json.loads(known_faces_json)
-            service.load_known_faces(known_faces)
-            result = service.recognize_face(base64_image)
-            print(json.dumps(result))
-        except json.JSONDecodeError:
-            print(json.dumps({
+            request = _json_loads(line)
+            request_id = request.get("id")
+            command, args = request["command"], request.get("args", [])
+        except (json.JSONDecodeError, KeyError, AttributeError, TypeError):
+            pipeline.respond(request_id, {
                 "success": False,
-                "message": "Invalid JSON format for known faces"
-            }))
-    
-    elif command == "validate":
-        if len(sys.argv) != 3:
-            print("Usage: validate <base64_image>")
-            sys.exit(1)
+                "message": "Invalid request format"
+            })
+            continue
         
-        base64_image = sys.argv[2]
-        result = service.validate_face_quality(base64_image)
-        print(json.dumps(result))
+        pipeline.submit(request_id, command, args)
     
-    else:
-        print(f"Unknown command: {command}")
+    pipeline.close()
+
+def main():
+    """Main function to handle command line interface"""
+    if len(sys.argv) < 2:
+        print("Usage: python face_recognition_service.py <command> [args...]")
+        print("       python face_recognition_service.py --serve")
+        print("Commands:")
+        print("  encode <base64_image> - Extract face encoding from image")
+        print("  recognize <base64_image> <known_faces_json> - Recognize face")
+        print("  validate <base64_image> - Validate face quality")
+        print("  encode_batch <base64_image> [<base64_image> ...] - Extract encodings from several images")
+        print("  recognize_batch <base64_images_json> <known_faces_json> - Recognize faces in several images")
+        print("  --serve - Read newline-delimited JSON requests from stdin")
+        sys.exit(1)
+    
+    service = FaceRecognitionService()
+    command = sys.argv[1]
+    
+    if command == "--serve":
+        serve(service)
+        return
+    
+    try:
+        result = run_command(service, command, sys.argv[2:])
+    except ValueError as e:
+        print(e)
         sys.exit(1)
+    
+    write_json(result)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,282 @@
+"""Tests for the parts of face_recognition_service that run without dlib or OpenCV"""
+
+import importlib.util
+import io
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+_spec = importlib.util.spec_from_file_location(
+    "face_recognition_service",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "face_recognition_service.py")
+)
+frs = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(frs)
+
+
+def make_gallery(count, seed=0):
+    """Random unit-norm 128-D encodings shaped like the database rows"""
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(size=(count, 128))
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    rows = [
+        {"id": i, "name": f"person{i}", "face_encoding": json.dumps(encodings[i].tolist())}
+        for i in range(count)
+    ]
+    return encodings, rows
+
+
+def test_cache_is_pruned_to_newest_entries(tmp_path):
+    service = frs.FaceRecognitionService()
+    service.cache_max_entries = 2
+    for count in range(1, 5):
+        _, rows = make_gallery(count)
+        service.load_known_faces_cached(json.dumps(rows), cache_dir=str(tmp_path))
+
+    assert len(list(tmp_path.glob("*.npz"))) == 2
+
+
+def test_cache_pruning_leaves_other_files_and_keeps_recently_used(tmp_path):
+    unrelated = tmp_path / "notes.txt"
+    unrelated.write_text("keep me")
+    other_archive = tmp_path / "data.npz"
+    other_archive.write_bytes(b"")
+
+    service = frs.FaceRecognitionService()
+    service.cache_max_entries = 2
+    galleries = [json.dumps(make_gallery(count)[1]) for count in (1, 2, 3)]
+    service.load_known_faces_cached(galleries[0], cache_dir=str(tmp_path))
+    service.load_known_faces_cached(galleries[1], cache_dir=str(tmp_path))
+    # Make the first gallery look old, then hit it so it becomes most recently used
+    first = tmp_path / f"{frs.hashlib.sha1(galleries[0].encode()).hexdigest()[:16]}.npz"
+    os.utime(first, (0, 0))
+    frs.FaceRecognitionService().load_known_faces_cached(galleries[0], cache_dir=str(tmp_path))
+    service.load_known_faces_cached(galleries[2], cache_dir=str(tmp_path))
+
+    assert unrelated.exists() and other_archive.exists()
+    assert first.exists()
+    assert len([path for path in tmp_path.glob("*.npz") if path.name != "data.npz"]) == 2
+
+
+def test_cache_not_written_when_persist_disabled(tmp_path):
+    service = frs.FaceRecognitionService()
+    service.persist_cache = False
+    _, rows = make_gallery(3)
+    service.load_known_faces_cached(json.dumps(rows), cache_dir=str(tmp_path))
+
+    assert service.known_face_ids == [0, 1, 2]
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize("scan_dtype", [np.int8, np.float16])
+def test_enrolled_encoding_matches_itself(scan_dtype):
+    encodings, rows = make_gallery(50)
+    service = frs.FaceRecognitionService()
+    service.scan_dtype = scan_dtype
+    service.simsimd_threshold = 0
+    service.load_known_faces(rows)
+
+    rng = np.random.default_rng(1)
+    for i, encoding in enumerate(encodings):
+        exact = service.match_face_encoding(encoding)
+        assert exact["success"] and exact["user_id"] == i
+
+        perturbed = service.match_face_encoding(encoding + 0.01 * rng.normal(size=128))
+        assert perturbed["success"] and perturbed["user_id"] == i
+
+
+def test_disagreeing_simsimd_kernel_falls_back_to_float32(monkeypatch):
+    class CosineDistanceSimsimd:
+        """Mimics simsimd 4.x, where int8 'dot' returned 1 - cosine similarity"""
+
+        @staticmethod
+        def cdist(a, b, metric):
+            a = a.astype(np.float32)
+            b = b.astype(np.float32)
+            cosine = (a @ b.T) / (np.linalg.norm(a, axis=1)[:, None] * np.linalg.norm(b, axis=1))
+            return 1 - cosine
+
+    monkeypatch.setattr(frs, "simsimd", CosineDistanceSimsimd)
+    encodings, rows = make_gallery(10)
+    service = frs.FaceRecognitionService()
+    service.simsimd_threshold = 0
+    service.load_known_faces(rows)
+
+    assert not service._use_simsimd
+    result = service.match_face_encoding(encodings[3])
+    assert result["success"] and result["user_id"] == 3
+
+
+def test_wrong_length_encodings_are_skipped():
+    encodings, rows = make_gallery(3)
+    rows.append({"id": 3, "name": "short_b64", "face_encoding_b64": frs._b64.b64encode(b"\0" * 500).decode("ascii")})
+    rows.append({"id": 4, "name": "short_json", "face_encoding": json.dumps([0.1] * 64)})
+    service = frs.FaceRecognitionService()
+    service.load_known_faces(rows)
+
+    assert service.known_face_ids == [0, 1, 2]
+    assert service.match_face_encoding(encodings[2])["user_id"] == 2
+
+
+def test_ann_index_built_lazily_in_serve_mode_only():
+    pytest.importorskip("hnswlib")
+    encodings, rows = make_gallery(30)
+
+    cli_service = frs.FaceRecognitionService()
+    cli_service.ann_threshold = 10
+    cli_service.load_known_faces(rows)
+    cli_service.match_face_encoding(encodings[0])
+    assert cli_service._index is None
+
+    serve_service = frs.FaceRecognitionService()
+    serve_service.ann_threshold = 10
+    serve_service.ann_min_queries = 3
+    serve_service.use_ann_index = True
+    serve_service.load_known_faces(rows)
+    for i in range(4):
+        assert serve_service.match_face_encoding(encodings[i])["user_id"] == i
+    assert serve_service._index is not None
+
+
+def test_nearest_128_finds_closest_row():
+    encodings, _ = make_gallery(20)
+    matrix = encodings.astype(np.float32)
+    index, distance = frs._nearest_128(matrix, matrix[7])
+
+    assert index == 7
+    assert distance == pytest.approx(0.0, abs=1e-6)
+
+
+def test_jitted_nearest_128_matches_python_kernel():
+    pytest.importorskip("numba")
+    encodings, _ = make_gallery(200)
+    matrix = encodings.astype(np.float32)
+    kernel = frs.nearest_128_kernel()
+    assert kernel is not None
+
+    rng = np.random.default_rng(2)
+    for i in (0, 7, 199):
+        probe = (matrix[i] + 0.01 * rng.normal(size=128)).astype(np.float32)
+        index, distance = kernel(matrix, probe)
+        expected_index, expected_distance = frs._nearest_128(matrix, probe)
+        assert index == expected_index == i
+        assert distance == pytest.approx(expected_distance, rel=1e-4)
+
+
+def test_jit_kernel_only_used_when_enabled(monkeypatch):
+    calls = []
+
+    def fake_kernel(matrix, probe):
+        calls.append(len(matrix))
+        return frs._nearest_128(matrix, probe)
+
+    monkeypatch.setattr(frs, "nearest_128_kernel", lambda: fake_kernel)
+    encodings, rows = make_gallery(10)
+    service = frs.FaceRecognitionService()
+    service.load_known_faces(rows)
+    service._use_simsimd = False
+
+    assert service.match_face_encoding(encodings[4])["user_id"] == 4
+    assert not calls
+
+    service.use_jit_kernel = True
+    assert service.match_face_encoding(encodings[5])["user_id"] == 5
+    assert calls == [10]
+
+
+def test_small_galleries_skip_simsimd():
+    pytest.importorskip("simsimd")
+    _, rows = make_gallery(20)
+    service = frs.FaceRecognitionService()
+    service.simsimd_threshold = 10
+    service.load_known_faces(rows)
+    assert service._use_simsimd
+
+    service.simsimd_threshold = 50
+    service.load_known_faces(rows)
+    assert not service._use_simsimd
+
+
+def test_serve_answers_each_request_by_id(monkeypatch, capsys):
+    encodings, rows = make_gallery(6)
+    gallery = json.dumps(rows)
+    service = frs.FaceRecognitionService()
+
+    # Images are "face<i>" (person i), "noface" or "bad" (undecodable); the
+    # decoded image carries i in its pixels so the stubs can map it back
+    def decode_base64_to_rgb(base64_image):
+        if base64_image == "bad":
+            raise ValueError("not an image")
+        value = 255 if base64_image == "noface" else int(base64_image[len("face"):])
+        return np.full((200, 200, 3), value, dtype=np.uint8)
+
+    def detect_faces_batch(images):
+        return [[] if image is None or image[0, 0, 0] == 255 else [(40, 160, 160, 40)] for image in images]
+
+    monkeypatch.setattr(service, "preload_models", lambda: None)
+    monkeypatch.setattr(service, "decode_base64_to_rgb", decode_base64_to_rgb)
+    monkeypatch.setattr(service, "detect_faces_batch", detect_faces_batch)
+    monkeypatch.setattr(service, "_detect_faces_for_validation", lambda image: [(40, 160, 160, 40)])
+    monkeypatch.setattr(service, "encode_first_face",
+                        lambda image, locations, num_jitters=0: encodings[image[0, 0, 0]] if locations else None)
+
+    requests = [
+        {"id": 1, "command": "encode", "args": ["face1"]},
+        {"id": 2, "command": "encode_batch", "args": ["face2", "bad"]},
+        {"id": 3, "command": "recognize", "args": ["face3", gallery]},
+        {"id": 4, "command": "recognize_batch", "args": [json.dumps(["face4", "noface"]), gallery]},
+        {"id": 5, "command": "validate", "args": ["face5"]},
+        {"id": 6, "command": "validate", "args": ["bad"]},
+        {"id": 7, "command": "frobnicate", "args": []},
+        {"id": 8, "command": "encode", "args": ["bad"]},
+    ]
+    lines = [json.dumps(request) for request in requests] + ["not json"]
+    monkeypatch.setattr(frs.sys, "stdin", io.StringIO("\n".join(lines) + "\n"))
+
+    frs.serve(service)
+
+    replies = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    results = {reply["id"]: reply["result"] for reply in replies}
+    assert len(replies) == len(lines)
+    assert sorted(results, key=str) == sorted([None, *range(1, 9)], key=str)
+
+    assert results[1]["success"] and len(results[1]["encoding"]) == 128
+    assert [result["success"] for result in results[2]["results"]] == [True, False]
+    assert results[3]["success"] and results[3]["user_id"] == 3
+    assert [result["success"] for result in results[4]["results"]] == [True, False]
+    assert results[4]["results"][0]["user_id"] == 4
+    assert results[5]["valid"]
+    assert not results[6]["valid"] and "not an image" in results[6]["message"]
+    assert results[7] == {"success": False, "message": "Unknown command: frobnicate"}
+    assert not results[8]["success"] and results[8]["encoding"] is None
+    assert results[None] == {"success": False, "message": "Invalid request format"}
+
+
+def test_match_face_encodings_agrees_with_single_matching():
+    encodings, rows = make_gallery(8)
+    rng = np.random.default_rng(3)
+    stranger = rng.normal(size=128)
+    stranger /= np.linalg.norm(stranger)
+    probes = [encodings[2], None, encodings[5] + 0.01 * rng.normal(size=128), stranger, None]
+
+    def assert_same_results(service):
+        results = service.match_face_encodings(probes)
+        assert len(results) == len(probes)
+        for result, probe in zip(results, probes):
+            expected = service.match_face_encoding(probe)
+            # GEMM and per-probe scans may differ in the last bits near distance 0
+            assert result.pop("confidence") == pytest.approx(expected.pop("confidence"), abs=0.1)
+            assert result == expected
+        return results
+
+    service = frs.FaceRecognitionService()
+    service.load_known_faces(rows)
+    results = assert_same_results(service)
+    assert [result.get("user_id") for result in results] == [2, None, 5, None, None]
+
+    empty = frs.FaceRecognitionService()
+    empty.load_known_faces([])
+    assert not any(result["success"] for result in assert_same_results(empty))
@@ -4,7 +4,8 @@ export interface User {
   id: number;
   name: string;
   email: string;
-  face_encoding: string; // Base64 encoded face data
+  face_encoding: string; // JSON encoded face data
+  face_encoding_b64?: string | null; // Base64 of float32 face encoding bytes
   created_at: string;
   is_active: boolean;
 }